@@ -1,8 +1,10 @@
 import os
+import json
 import random
-import numpy as np
-from moviepy.editor import VideoFileClip, CompositeVideoClip, ImageClip, vfx
-from PIL import Image, ImageDraw, ImageFont
+import asyncio
+import functools
+import subprocess
+from pathlib import Path
 
 # =========================
 # CONFIGURATION
@@ -10,12 +12,14 @@ from PIL import Image, ImageDraw, ImageFont
 INPUT_DIR = "reels_downloads"
 OUTPUT_DIR = "output_reels"
 WATERMARK_TEXT = "@my_page"  # <-- change this
+FAST_TRIM_ONLY = False       # True = trim only (stream copy, no watermark/speed-up/resize)
+SPEED_UP_CHANCE = 1.0        # chance (0..1) that a reel gets the random 1–3% speed-up
+RANDOM_SEED = None           # set an int for reproducible speed/emoji/hashtag picks
+TARGET_SIZE = None           # e.g. (1080, 1920) to letterbox every reel to that size
 
 EMOJIS = ["🔥", "💫", "🎬", "✨", "⚡", "🎵"]
 HASHTAGS = ["#reels", "#foryou", "#explore", "#trending", "#viral"]
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
 # =========================
 # FONT RESOLUTION
 # =========================
@@ -25,142 +29,314 @@ SYSTEM_FONTS = (
     "Roboto-Regular.ttf",
 )
 
-def resolve_font(size_px: int):
-    """Try system fonts, fallback to Pillow default."""
+@functools.lru_cache(maxsize=None)
+def resolve_font_path():
+    """
+    Try system fonts, then whatever fontconfig has installed.
+    None means drawtext falls back to ffmpeg's default font. Resolved once.
+    """
     for p in SYSTEM_FONTS:
+        if os.path.exists(p):
+            return p
+
+    # Static ffmpeg builds often lack fontconfig, so ask fc-match ourselves
+    try:
+        found = subprocess.run(
+            ["fc-match", "-f", "%{file}", "sans-serif"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return found if found and os.path.exists(found) else None
+
+# =========================
+# ENCODER SELECTION
+# =========================
+# Hardware encoders first, libx264 last. Each entry's args are tried as-is
+# during probing, so an encoder is only picked if it works on this machine.
+VIDEO_ENCODERS = {
+    "h264_nvenc": ["-preset", "p4", "-tune", "hq", "-rc", "vbr", "-cq", "23", "-b:v", "0"],
+    "h264_videotoolbox": ["-q:v", "65"],
+    "libx264": ["-preset", "veryfast", "-crf", "23"],
+}
+
+# Consumer GPUs cap concurrent encode sessions (NVENC: 3-8 depending on driver),
+# so hardware encodes run at most this many at a time
+HW_ENCODE_JOBS = 2
+
+# Matching hardware decode, input-side. Frames are still downloaded to system
+# memory (drawtext runs on the CPU), but the bitstream decode leaves the CPU.
+HWACCEL_DECODE = {
+    "h264_nvenc": ["-hwaccel", "cuda"],
+}
+
+@functools.lru_cache(maxsize=None)
+def pick_video_encoder():
+    """Return the first usable encoder from VIDEO_ENCODERS. Probed once per process."""
+    try:
+        listed = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return "libx264"
+
+    for codec, params in VIDEO_ENCODERS.items():
+        if codec == "libx264" or f" {codec} " not in listed:
+            continue
+        # Being compiled in doesn't mean the GPU is there; do a tiny test encode
         try:
-            if os.path.exists(p):
-                return ImageFont.truetype(p, size_px)
-        except Exception:
+            subprocess.run(
+                [
+                    "ffmpeg", "-v", "error",
+                    "-f", "lavfi", "-i", "color=size=256x256:duration=0.1",
+                    "-c:v", codec, *params,
+                    "-f", "null", "-",
+                ],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                check=True,
+                timeout=30,
+            )
+            return codec
+        except (OSError, subprocess.SubprocessError):
             continue
-    return ImageFont.load_default()
+    return "libx264"
+
+# =========================
+# FFMPEG HELPERS
+# =========================
+async def run_tool(*cmd: str) -> str:
+    """Run ffmpeg/ffprobe without blocking the event loop; return stdout, raise on failure."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,  # keep ffmpeg off the terminal
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    out, err = await proc.communicate()
+    out, err = out.decode(errors="replace"), err.decode(errors="replace")
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=out, stderr=err)
+    return out
+
+async def probe_video(path: str):
+    """
+    Return (width, height, duration) of the first video stream via ffprobe.
+    Width/height are as displayed, i.e. after ffmpeg's auto-rotation.
+    """
+    out = await run_tool(
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries",
+        "stream=width,height:stream_tags=rotate:stream_side_data=rotation:format=duration",
+        "-of", "json",
+        path,
+    )
+    info = json.loads(out)
+    stream = info["streams"][0]
+    w, h = int(stream["width"]), int(stream["height"])
+
+    # Phone clips are often stored landscape with a 90/270° rotate tag or display matrix
+    rotation = stream.get("tags", {}).get("rotate")
+    if rotation is None:
+        rotation = next(
+            (sd["rotation"] for sd in stream.get("side_data_list", []) if "rotation" in sd),
+            0,
+        )
+    if int(float(rotation)) % 180 == 90:
+        w, h = h, w
+    return w, h, float(info["format"]["duration"])
+
+async def stream_copy_trim(src: str, dst: str, start: float, end: float):
+    """
+    Cut [start, end] out of src without re-encoding.
+    Stream copy can only cut on keyframes, so the trim loses sub-keyframe accuracy.
+    """
+    await run_tool(
+        "ffmpeg", "-y", "-v", "error",
+        "-ss", f"{start:.3f}", "-to", f"{end:.3f}",
+        "-i", src,
+        "-c", "copy",
+        "-avoid_negative_ts", "make_zero",
+        "-movflags", "+faststart",
+        dst,
+    )
+
+def _filter_escape(value: str) -> str:
+    """Escape a filter option value for both the option and filtergraph parsers."""
+    for ch in "\\':":
+        value = value.replace(ch, "\\" + ch)
+    for ch in "\\'[],;":
+        value = value.replace(ch, "\\" + ch)
+    return value
 
 # =========================
 # WATERMARK BUILDER (center-bottom, semi-transparent)
 # =========================
-def make_watermark_clip(text: str, duration: float, frame_w: int, frame_h: int):
+def make_watermark_filter(text: str, frame_h: int):
     """
     Text-only watermark centered at bottom, small and 50% transparent.
-    Uses RGB + alpha mask directly, avoiding black bars.
+    Rendered by ffmpeg's drawtext filter, so frames never enter Python.
     """
+    if not text:
+        return None
+
+    font_px  = max(24, int(frame_h * 0.035))   # smaller size
+    stroke_w = max(2, int(font_px * 0.07))
+    margin_bottom = max(40, int(frame_h * 0.035))
+
+    opts = [
+        f"text={_filter_escape(text)}",
+        "expansion=none",
+        f"fontsize={font_px}",
+        "fontcolor=white@0.5",        # 50% opacity white
+        f"borderw={stroke_w}",
+        "bordercolor=black@0.7",      # slightly transparent black stroke
+        "x=(w-tw)/2",
+        f"y=h-th-{margin_bottom}",
+    ]
+    font_path = resolve_font_path()
+    if font_path:
+        opts.insert(0, f"fontfile={_filter_escape(font_path)}")
+    return "drawtext=" + ":".join(opts)
+
+# =========================
+# PER-FILE PIPELINE
+# =========================
+def _draw_edits(rng: random.Random):
+    """Pick one reel's (speed, emoji, hashtag)."""
+    speed = 1.0
+    if not FAST_TRIM_ONLY and rng.random() < SPEED_UP_CHANCE:
+        speed = 1 + rng.uniform(0.01, 0.03)
+    return speed, rng.choice(EMOJIS), rng.choice(HASHTAGS)
+
+async def _process_one(file: str, edits: tuple, threads: int = 4):
+    """Trim, speed up, watermark and re-caption a single reel."""
+    speed, emoji, hashtag = edits
+    base = os.path.splitext(file)[0]
+    video_path = os.path.join(INPUT_DIR, file)
+    caption_path = os.path.join(INPUT_DIR, f"{base}.txt")
+    output_video_path = os.path.join(OUTPUT_DIR, f"{base}.mp4")
+    output_caption_path = os.path.join(OUTPUT_DIR, f"{base}.txt")
+
+    print(f"🎞️  Processing {video_path} ...")
     try:
-        font_px  = max(24, int(frame_h * 0.035))   # smaller size
-        stroke_w = max(2, int(font_px * 0.07))
-        font     = resolve_font(font_px)
-
-        # Measure text
-        dummy = Image.new("L", (10, 10))
-        d = ImageDraw.Draw(dummy)
-        bbox = d.textbbox((0, 0), text, font=font, stroke_width=stroke_w)
-        text_w, text_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
-
-        # Render RGBA
-        img = Image.new("RGBA", (text_w, text_h), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        draw.text(
-            (0, 0),
-            text,
-            font=font,
-            fill=(255, 255, 255, 128),  # 50% opacity white
-            stroke_width=stroke_w,
-            stroke_fill=(0, 0, 0, 180),  # slightly transparent black stroke
-        )
+        w, h, duration = await probe_video(video_path)
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Failed to open '{video_path}': {e.stderr.strip() or e}")
+        return
+    except Exception as e:
+        print(f"❌ Failed to open '{video_path}': {e}")
+        return
+
+    try:
+        # Trim 0.2s from start and end
+        start = 0.2
+        end = max(duration - 0.2, 0.5)
+
+        # Optional resize to the target reel size (done by ffmpeg's swscale)
+        scale = None
+        if TARGET_SIZE and not FAST_TRIM_ONLY and (w, h) != tuple(TARGET_SIZE):
+            tw, th = TARGET_SIZE
+            scale = (
+                f"scale={tw}:{th}:force_original_aspect_ratio=decrease,"
+                f"pad={tw}:{th}:(ow-iw)/2:(oh-ih)/2"
+            )
+            h = th
+
+        # Watermark centered bottom
+        wm = None if FAST_TRIM_ONLY else make_watermark_filter(WATERMARK_TEXT, h)
+
+        if wm is None and scale is None and speed == 1.0:
+            # Nothing touches the pixels, so skip the re-encode
+            await stream_copy_trim(video_path, output_video_path, start, end)
+        else:
+            vfilters = []
+            afilters = []
+            if speed != 1.0:
+                vfilters.append(f"setpts=PTS/{speed:.5f}")
+                afilters = ["-af", f"atempo={speed:.5f}"]
+            if scale:
+                vfilters.append(scale)
+            if wm:
+                vfilters.append(wm)
 
-        arr = np.array(img)
-        rgb = arr[..., :3]
-        alpha = arr[..., 3] / 255.0
+            encoder = pick_video_encoder()
 
-        # Create RGB + alpha clips
-        txt_clip = ImageClip(rgb, ismask=False)
-        mask_clip = ImageClip(alpha, ismask=True)
-        txt_clip = txt_clip.set_mask(mask_clip).set_duration(duration)
+            await run_tool(
+                "ffmpeg", "-y", "-v", "error",
+                *HWACCEL_DECODE.get(encoder, []),
+                "-ss", f"{start:.3f}", "-to", f"{end:.3f}",
+                "-i", video_path,
+                "-vf", ",".join(vfilters),
+                *afilters,
+                "-c:v", encoder, *VIDEO_ENCODERS[encoder],
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac",
+                # -threads only affects libx264; hardware encoders ignore it
+                *(["-threads", str(threads)] if encoder == "libx264" else []),
+                "-movflags", "+faststart",
+                output_video_path,
+            )
 
-        # Center horizontally, bottom vertically
-        margin_bottom = max(40, int(frame_h * 0.035))
-        x = (frame_w - text_w) / 2
-        y = frame_h - text_h - margin_bottom
+        # Caption update
+        try:
+            caption = Path(caption_path).read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            caption = ""
+        caption = (caption + " " + emoji).strip()
+        caption += f"\n{hashtag}"
+        Path(output_caption_path).write_text(caption, encoding="utf-8")
 
-        return txt_clip.set_position((x, y))
+        print(f"✅  Done: {output_video_path}")
 
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Error processing '{video_path}': {e.stderr.strip() or e}")
     except Exception as e:
-        print(f"⚠️  Watermark creation failed: {e}")
-        return None
+        print(f"❌ Error processing '{video_path}': {e}")
 
 # =========================
 # MAIN PROCESS
 # =========================
-def main():
-    files = sorted(f for f in os.listdir(INPUT_DIR) if f.lower().endswith(".mp4")) if os.path.isdir(INPUT_DIR) else []
+async def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    files = []
+    if os.path.isdir(INPUT_DIR):
+        with os.scandir(INPUT_DIR) as it:
+            files = sorted(e.name for e in it if e.name.lower().endswith(".mp4") and e.is_file())
     if not files:
         print("ℹ️  No MP4 files found. Place videos in 'reels_downloads/' and rerun.")
         return
 
-    for file in files:
-        base = os.path.splitext(file)[0]
-        video_path = os.path.join(INPUT_DIR, f"{base}.mp4")
-        caption_path = os.path.join(INPUT_DIR, f"{base}.txt")
-        output_video_path = os.path.join(OUTPUT_DIR, f"{base}.mp4")
-        output_caption_path = os.path.join(OUTPUT_DIR, f"{base}.txt")
+    encoder = pick_video_encoder()
+    print(f"🎛️  Video encoder: {encoder}")
 
-        print(f"🎞️  Processing {video_path} ...")
-        try:
-            clip = VideoFileClip(video_path)
-        except Exception as e:
-            print(f"❌ Failed to open '{video_path}': {e}")
-            continue
+    # Several ffmpeg encodes at once, each with a couple of threads of its own
+    jobs = max(1, min(len(files), (os.cpu_count() or 1) // 2))
+    if encoder != "libx264":
+        jobs = min(jobs, HW_ENCODE_JOBS)
+    threads = 2 if jobs > 1 else 4
+    sem = asyncio.Semaphore(jobs)
 
-        try:
-            w, h = clip.size
-
-            # Trim 0.2s from start and end
-            start = 0.2
-            end = max(clip.duration - 0.2, 0.5)
-            subclip = clip.subclip(start, end)
+    # Random picks are drawn up front, in file order, so a seed reproduces them
+    # no matter which encode finishes first
+    rng = random.Random(RANDOM_SEED)
+    edits = [_draw_edits(rng) for _ in files]
 
-            # Random speed-up 1–3%
-            speed = 1 + random.uniform(0.01, 0.03)
-            subclip = subclip.fx(vfx.speedx, speed)
+    async def run_one(file, file_edits):
+        async with sem:
+            await _process_one(file, file_edits, threads)
 
-            # Watermark centered bottom
-            wm = make_watermark_clip(WATERMARK_TEXT, subclip.duration, w, h)
-            final_clip = CompositeVideoClip([subclip, wm]) if wm else subclip
-
-            fps = getattr(clip, "fps", 30)
-            final_clip.write_videofile(
-                output_video_path,
-                codec="libx264",
-                audio_codec="aac",
-                fps=fps,
-                threads=4,
-                ffmpeg_params=["-pix_fmt", "yuv420p"],
-                logger=None,
-            )
-
-            # Caption update
-            caption = ""
-            if os.path.exists(caption_path):
-                with open(caption_path, "r", encoding="utf-8") as f:
-                    caption = f.read().strip()
-            caption = (caption + " " + random.choice(EMOJIS)).strip()
-            caption += f"\n{random.choice(HASHTAGS)}"
-            with open(output_caption_path, "w", encoding="utf-8") as f:
-                f.write(caption)
-
-            print(f"✅  Done: {output_video_path}")
-
-        except Exception as e:
-            print(f"❌ Error processing '{video_path}': {e}")
-
-        finally:
-            try:
-                final_clip.close()
-                subclip.close()
-                clip.close()
-            except Exception:
-                pass
+    await asyncio.gather(*(run_one(f, e) for f, e in zip(files, edits)))
 
     print("🎉  All videos processed successfully!")
 
 if __name__ == "__main__":
-    random.seed()
-    main()
+    asyncio.run(main())